@@ -1,20 +1,62 @@
 import streamlit as st
 import requests
 import time
-
-BASE_URL = st.secrets["api"]["BASE_URL"]
+import uuid
+import threading
+import orjson
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+@st.cache_resource
+def get_http():
+    """One pooled keep-alive session + BASE_URL, built once per process (survives reruns)"""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4, pool_maxsize=8,
+        max_retries=Retry(total=3, connect=3, backoff_factor=0.5, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    session.headers["Accept-Encoding"] = "gzip"   # backend gzips /updates and the update stream
+    return session, st.secrets["api"]["BASE_URL"]
+
+SESSION, BASE_URL = get_http()
+
+CODE_PREVIEW_LINES = 500
+# (connect, read) - a dead backend fails fast instead of hanging the script
+TIMEOUT = (3, 30)
+STREAM_TIMEOUT = (3, 60)   # server sends a keep-alive line every 15s
+COMMIT_TIMEOUT = (3, 150)  # backend gives up on GitHub after 120s (rate-limit backoff)
+# Live code preview redraw: every redraw re-sends the whole buffer, so at most
+# 4 Hz, sooner once this many new bytes queue up
+PREVIEW_FLUSH_SECS = 0.25
+PREVIEW_FLUSH_BYTES = 8192
 
 # Session State
 for key in ["keep_alive", "show_thinking", "session_id", "code", "description", 
-            "thinking", "suggestions", "repo_url", "token_info"]:
+            "thinking", "suggestions", "repo_url", "token_info", "last_request", "client_id"]:
     if key not in st.session_state:
         st.session_state[key] = False if key in ["keep_alive", "show_thinking"] else "" if key != "token_info" else {}
+if not st.session_state.client_id:
+    st.session_state.client_id = str(uuid.uuid4())   # lets the backend dedupe our own double-submits
+
+# Wake a sleeping Render dyno (and open the pooled connection) while the page renders
+def warm_up():
+    try:
+        SESSION.get(f"{BASE_URL}/", timeout=(3, 60))
+    except requests.RequestException:
+        pass
+
+if "warmed_up" not in st.session_state:
+    st.session_state.warmed_up = True
+    threading.Thread(target=warm_up, daemon=True).start()
 
 # Keep Render Alive
 if st.session_state.keep_alive:
     if "last_ping" not in st.session_state or time.time() - st.session_state.last_ping > 600:
         try:
-            requests.get(f"{BASE_URL}/", timeout=5)
+            SESSION.get(f"{BASE_URL}/", timeout=TIMEOUT)
             st.session_state.last_ping = time.time()
         except:
             pass
@@ -35,9 +77,14 @@ github_repo = st.text_input("GitHub Repo (optional)", value="")
 
 # ------------------ Helpers ------------------
 def start_project(spec: str, github_repo: str = "") -> str | None:
+    # Generating the same spec again is a request for a new attempt, not the cached one
+    request = {"spec": spec, "github_repo": github_repo}
+    regenerate = st.session_state.last_request == request
+    st.session_state.last_request = request
     try:
-        resp = requests.post(f"{BASE_URL}/generate-project", 
-                           json={"spec": spec, "github_repo": github_repo}, timeout=20)
+        resp = SESSION.post(f"{BASE_URL}/generate-project", 
+                           json={**request, "regenerate": regenerate,
+                                 "client_id": st.session_state.client_id}, timeout=TIMEOUT)
         resp.raise_for_status()
         return resp.json()["session_id"]
     except Exception as e:
@@ -50,63 +97,94 @@ def apply_suggestion(session_id: str, suggestion: str):
         return None, None
 
     try:
-        resp = requests.post(
+        resp = SESSION.post(
             f"{BASE_URL}/suggest-changes", 
             json={"session_id": session_id, "suggestion": suggestion.strip()}, 
-            timeout=20
+            timeout=TIMEOUT
         )
         resp.raise_for_status()
         st.success("✅ Suggestion applied! Updating code...")
         
         # Important: Refresh the full state
-        return poll_updates(session_id)
+        return stream_updates(session_id, resp.json().get("since", 0))
     except Exception as e:
         st.error(f"❌ Failed to apply suggestion: {e}")
         return None, None
 
 
-def poll_updates(session_id: str):
-    """Improved polling - clears old code and updates everything"""
+def iter_message_batches(resp):
+    """Split a streamed NDJSON body into messages, one batch per network read"""
+    tail = b""
+    for chunk in resp.iter_content(chunk_size=65536):
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()   # incomplete last line, finished by the next read
+        batch = [orjson.loads(line) for line in lines if line.strip()]   # blank lines are keep-alives
+        if batch:
+            yield batch
+
+
+def stream_updates(session_id: str, since: int = 0):
+    """Consume the backend update stream - one connection, no polling"""
     status_container = st.empty()
-    code_text = ""   # Reset code text
+    code_box = st.empty()   # live preview while the code streams in
+    code_lines = []   # Reset code, joined once at the end
+    streamed = []     # code_chunk deltas: preview only, superseded by code_block
+    pending_bytes = 0
+    last_draw = time.monotonic()
 
-    done = False
     repo_url = None
 
-    while not done:
-        try:
-            resp = requests.get(f"{BASE_URL}/updates/{session_id}", timeout=30)
+    try:
+        with SESSION.get(f"{BASE_URL}/updates-stream/{session_id}", params={"since": since}, stream=True, timeout=STREAM_TIMEOUT) as resp:
             resp.raise_for_status()
-            data = resp.json()
-
-            done = data.get("done", False)
-            repo_url = data.get("repo_url")
-
-            for msg in data.get("messages", []):
-                typ = msg.get("type")
-                content = msg.get("message", "")
-
-                if typ == "status":
-                    status_container.write(f"📢 **{content}**")
-                elif typ == "code":
-                    code_text += content + "\n"
-                elif typ == "description":
-                    st.session_state.description = content
-                elif typ == "thinking":
-                    st.session_state.thinking = content
-                elif typ == "suggestions":
-                    st.session_state.suggestions = content
-                elif typ == "token_info":
-                    st.session_state.token_info = content
-
-        except Exception as e:
-            st.error(f"❌ Polling error: {e}")
-            break
-
-        time.sleep(0.6)
-
-    # Update session state with latest code
-    st.session_state.code = code_text
+            for batch in iter_message_batches(resp):
+                latest_status = None
+                for msg in batch:
+                    typ = msg.get("type")
+                    content = msg.get("message", "")
+
+                    if typ == "status":
+                        latest_status = content
+                    elif typ == "code_block":
+                        code_lines = [content]   # whole file in one frame
+                        streamed = []
+                        pending_bytes += len(content)
+                    elif typ == "code_chunk":
+                        streamed.append(content)
+                        pending_bytes += len(content)
+                    elif typ == "code":
+                        code_lines.append(content)
+                        pending_bytes += len(content) + 1
+                    elif typ == "description":
+                        st.session_state.description = content
+                    elif typ == "thinking":
+                        st.session_state.thinking = content
+                    elif typ == "suggestions":
+                        st.session_state.suggestions = content
+                    elif typ == "token_info":
+                        st.session_state.token_info = content
+                    elif typ == "done":
+                        repo_url = msg.get("repo_url")
+
+                # One redraw per network read, however many frames it carried
+                if latest_status is not None:
+                    status_container.write(f"📢 **{latest_status}**")
+                # Coalesce small deltas; the final render happens in the results section
+                if pending_bytes and (pending_bytes >= PREVIEW_FLUSH_BYTES
+                                      or time.monotonic() - last_draw >= PREVIEW_FLUSH_SECS):
+                    preview = "\n".join(code_lines) if code_lines else "".join(streamed)
+                    code_box.code(preview, language="python")
+                    pending_bytes, last_draw = 0, time.monotonic()
+
+    except Exception as e:
+        st.error(f"❌ Streaming error: {e}")
+
+    code_box.empty()   # the results section renders the final code
+
+    # Update session state with latest code; no code frames means the code is unchanged
+    if code_lines:
+        st.session_state.code = "\n".join(code_lines) + "\n"
+    code_text = st.session_state.get("code") or ""
     st.session_state.repo_url = repo_url
 
     return code_text, repo_url
@@ -114,7 +192,7 @@ def poll_updates(session_id: str):
 
 def commit_to_github(session_id: str):
     try:
-        resp = requests.post(f"{BASE_URL}/commit", json={"session_id": session_id}, timeout=15)
+        resp = SESSION.post(f"{BASE_URL}/commit", json={"session_id": session_id}, timeout=COMMIT_TIMEOUT)
         resp.raise_for_status()
         url = resp.json().get("repo_url")
         if url:
@@ -145,6 +223,22 @@ def debug_token_info():
         st.write("token_info content:", st.session_state.get("token_info", "NOT FOUND"))
         st.write("Full session keys:", list(st.session_state.keys()))
 
+# Fragment: the checkbox and buttons inside rerun only this panel, not the whole app
+@st.fragment
+def code_panel():
+    clean_code = st.session_state.code.replace("```python", "").replace("```", "").strip()
+    code_lines = clean_code.splitlines()
+    # Highlighting is client-side; only ship the first CODE_PREVIEW_LINES unless asked
+    if len(code_lines) > CODE_PREVIEW_LINES and not st.checkbox(f"Show full code ({len(code_lines)} lines)"):
+        st.code("\n".join(code_lines[:CODE_PREVIEW_LINES]), language="python")
+        st.caption(f"Showing the first {CODE_PREVIEW_LINES} of {len(code_lines)} lines.")
+    else:
+        st.code(clean_code, language="python")   # Removed height=500
+
+    st.download_button("⬇️ Download Code", data=clean_code, file_name="main.py", mime="text/x-python")
+    show_cost_button()
+    debug_token_info()
+
 # Generate Button
 if st.button("🚀 Generate Project", type="primary"):
     if spec.strip():
@@ -152,7 +246,7 @@ if st.button("🚀 Generate Project", type="primary"):
             session_id = start_project(spec, github_repo)
             if session_id:
                 st.session_state.session_id = session_id
-                poll_updates(session_id)
+                stream_updates(session_id)
 
 # Results Section
 if st.session_state.get("code"):
@@ -164,12 +258,7 @@ if st.session_state.get("code"):
         st.markdown(st.session_state.thinking)
 
     st.subheader("✅ Generated Code")
-    clean_code = st.session_state.code.replace("```python", "").replace("```", "").strip()
-    st.code(clean_code, language="python")   # Removed height=500
-            
-
-    show_cost_button()
-    debug_token_info()
+    code_panel()
 
 
 
@@ -200,9 +289,12 @@ with col_b:
             del st.session_state[key]
         st.rerun()
 
+def clear_suggestion():
+    # Runs before the rerun, so the keyed widget picks up the new value
+    st.session_state.suggestion_input = ""
+
 with col_c:
-    if st.button("Clear"):
-        st.session_state.suggestion_input = ""
+    st.button("Clear", on_click=clear_suggestion)
 
 # Commit
 if st.session_state.get("session_id") and st.session_state.get("code"):
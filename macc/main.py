@@ -1,31 +1,54 @@
 # main.py
 import os
+import atexit
+import queue
+import re
+import ast
 import warnings
 import asyncio
 import logging
 import time
 import json
+import threading
 import uuid
+import hashlib
+import zlib
+import orjson
+import httpx
 import concurrent.futures
-#from functools import lru_cache
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from functools import lru_cache
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from concurrent.futures import ThreadPoolExecutor
-from typing import Dict, Any, Optional, TypedDict
+from typing import Dict, Any, List, Optional, TypedDict
 from openai import OpenAI
 # from mistralai.client import Mistral
 from mistralai import Mistral
 
 from dotenv import load_dotenv
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
-from github import Github
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, ORJSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from github import Auth, Github, GithubException, GithubRetry, InputGitTreeElement
 
 #LangGraph
 from langgraph.graph import StateGraph, START, END
+from langchain_core.runnables import RunnableConfig
 
 # ---------------- Logging & env ----------------
-logging.basicConfig(level=logging.INFO, filename="agent_logs.txt")
+# Log calls only enqueue; a listener thread does the file writes, so request
+# handlers and worker threads never wait on disk
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+log_listener = QueueListener(
+    log_queue, RotatingFileHandler("agent_logs.txt", maxBytes=10_000_000, backupCount=5)
+)
+log_listener.start()
+atexit.register(log_listener.stop)   # flush what is still queued
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
 logging.info("Starting MACC application")
 
 os.environ["PYDANTIC_SKIP_VALIDATING_ASSIGNMENT"] = "1"
@@ -43,10 +66,36 @@ if not GITHUB_TOKEN:
 if not MISTRAL_API_KEY:
     raise ValueError("MISTRAL_API_KEY missing in environment")
 
-mistral = Mistral(api_key=MISTRAL_API_KEY)
-
 # ---------------- FastAPI ----------------
-app = FastAPI(title="MACC - Multi-Agent AI Code Collaborator")
+def prewarm_providers():
+    """Open the provider connections (TLS handshake) before the first user request."""
+    for name, warm in (("Mistral", lambda: get_mistral().models.list()),
+                       ("OpenRouter", lambda: get_openrouter().models.list())):
+        try:
+            warm()
+            logging.info(f"{name} connection pre-warmed")
+        except Exception as e:
+            logging.warning(f"{name} pre-warm failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # asyncio.to_thread uses the default executor; size it for IO-bound graph runs
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="graph")
+    )
+    # Fire and forget: startup does not wait on the providers
+    prewarm = asyncio.create_task(asyncio.to_thread(prewarm_providers))
+    # Fresh queue per loop: an asyncio.Queue binds to the loop that first waits on it
+    global job_queue
+    job_queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    workers = [asyncio.create_task(job_worker()) for _ in range(JOB_WORKERS)]
+    yield
+    prewarm.cancel()
+    for worker in workers:
+        worker.cancel()
+
+# orjson encodes the polled message lists (full code blocks) several times faster
+app = FastAPI(lifespan=lifespan, title="MACC - Multi-Agent AI Code Collaborator", default_response_class=ORJSONResponse)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # tighten for production
@@ -54,36 +103,72 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Polled JSON (code lines, statuses) compresses well; the update stream gzips itself
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # ---------------- In-memory state ----------------
-# session_id -> list[dict] of messages (message consumed on GET /updates)
+# session_id -> list[dict] of messages (append-only, addressed by offset)
 session_messages: Dict[str, list] = {}
-# session_id -> final context (spec, code, readme, repo name/url)
-project_context: Dict[str, Dict[str, Any]] = {}
+# session_id -> offset of the first message not yet drained by a reader
+session_cursor: Dict[str, int] = {}
+# session_id -> absolute offset of session_messages[sid][0] (messages trimmed so far)
+session_log_base: Dict[str, int] = {}
+# session_id -> final context, set once generation finishes
+project_context: Dict[str, "SessionCtx"] = {}
 # sentinel for finished sessions
 session_done: Dict[str, bool] = {}
-
-# executor for blocking Crew calls
-executor = ThreadPoolExecutor(max_workers=4)
+# session_id -> event set (and dropped) by the next enqueue; readers await it instead of sleeping
+session_wakeup: Dict[str, asyncio.Event] = {}
+# session_id -> last access time, least recently used first
+session_seen: "OrderedDict[str, float]" = OrderedDict()
+
+# Sessions idle past the TTL, or oldest beyond the cap, are dropped from memory
+SESSION_TTL = 3600
+MAX_SESSIONS = 1024
+# One oversized spec/suggestion must not balloon a session's prompts and context
+MAX_INPUT_CHARS = 32_000
+# Per-session message log cap (streamed code_chunk deltas add up); past it the
+# oldest quarter is dropped at once. Offsets stay absolute across trims.
+MAX_LOG_MESSAGES = 4096
 
 # ---------------- Models ----------------
-class ProjectRequest(BaseModel):
+@dataclass(slots=True)
+class SessionCtx:
+    """A finished project: what refine and commit work from. Slots keep it small per session."""
     spec: str
+    github_repo: str
+    tasks: str
+    code: str
+    readme: str = ""
+    description: str = ""
+    thinking: str = ""
+    suggestions: str = ""
+    repo_url: Optional[str] = None
+    token_info: Dict[str, Any] = field(default_factory=dict)
+
+class ProjectRequest(BaseModel):
+    spec: str = Field(max_length=MAX_INPUT_CHARS)
     github_repo: Optional[str] = ""
+    regenerate: bool = False   # skip cached results and ask the models for a new attempt
+    client_id: Optional[str] = Field(None, max_length=64)   # only this client's duplicates share a session
 
 class SuggestionRequest(BaseModel):
     session_id: str
-    suggestion: str
+    suggestion: str = Field(max_length=MAX_INPUT_CHARS)
 
 class CommitRequest(BaseModel):
     session_id: str
 
 # ---------------- Utility helpers ----------------
+# Anything that is not a letter, number or whitespace (\w also allows "_")
+_SLUG_JUNK_RE = re.compile(r"[^\w\s]|_")
+
 def safe_slug(text: str, max_len: int = 28) -> str:
     """Improved slug for GitHub repo names"""
-    s = text.lower()
+    # Only the start of a (possibly 32k-char) spec can end up in the slug
+    s = text[:max_len * 4].lower()
     # Keep only letters, numbers and spaces
-    s = "".join(c if c.isalnum() or c.isspace() else " " for c in s)
+    s = _SLUG_JUNK_RE.sub(" ", s)
     s = "-".join(s.split())
     s = s.strip("-")
     if not s or len(s) < 3:
@@ -93,25 +178,85 @@ def safe_slug(text: str, max_len: int = 28) -> str:
         s = s[:max_len].rstrip("-")
     return s
 
+def prune_sessions():
+    """Evict idle sessions, then least recently used ones past MAX_SESSIONS."""
+    cutoff = time.monotonic() - SESSION_TTL
+    while session_seen:
+        sid, seen = next(iter(session_seen.items()))
+        if seen > cutoff and len(session_seen) <= MAX_SESSIONS:
+            break
+        del session_seen[sid]
+        for store in (session_messages, session_cursor, session_log_base, project_context,
+                      session_done, session_wakeup):
+            store.pop(sid, None)
+
+# "name", "owner/name" or "[https://]github.com/owner/name" (optionally ending in .git
+# or "/"). Names are 1-100 chars of letters, digits, "_", "." and "-", and not only
+# dots and dashes; a github.com URL must name both owner and repo.
+_REPO_RE = re.compile(
+    r"^(?:(?:https?://)?(?:www\.)?github\.com/[A-Za-z0-9-]+/|[A-Za-z0-9-]+/)?"
+    r"(?![.-]+(?:\.git)?/?$)([A-Za-z0-9_.-]{1,100}?)(?:\.git)?/?$",
+    re.ASCII,
+)
+
+def parse_repo_name(text: str) -> Optional[str]:
+    """Short repo name from user input, or None if it is not a valid GitHub repo name."""
+    m = _REPO_RE.match(text.strip())
+    return m.group(1) if m else None
+
 def ensure_session(session_id: str):
+    is_new = session_id not in session_seen
+    session_seen[session_id] = time.monotonic()
+    session_seen.move_to_end(session_id)
+    if is_new:
+        prune_sessions()
     if session_id not in session_messages:
         session_messages[session_id] = []
+        session_cursor[session_id] = 0
+        session_log_base[session_id] = 0
     if session_id not in session_done:
         session_done[session_id] = False
-    if session_id not in project_context:
-        project_context[session_id] = {}
 
 def enqueue_message(session_id: str, typ: str, message: str):
     """Append a message to session message list (for polling)."""
     ensure_session(session_id)
-    session_messages[session_id].append({"type": typ, "message": message})
+    log = session_messages[session_id]
+    log.append({"type": typ, "message": message})
+    if len(log) > MAX_LOG_MESSAGES:
+        drop = MAX_LOG_MESSAGES // 4
+        del log[:drop]
+        session_log_base[session_id] += drop
+    wakeup = session_wakeup.pop(session_id, None)
+    if wakeup is not None:
+        wakeup.set()
+
+def next_message_event(session_id: str) -> asyncio.Event:
+    """Event set by the next enqueue. Grab it before reading so nothing slips in between."""
+    wakeup = session_wakeup.get(session_id)
+    if wakeup is None:
+        wakeup = session_wakeup[session_id] = asyncio.Event()
+    return wakeup
 
 def drain_messages(session_id: str) -> list:
-    """Return accumulated messages and clear them."""
+    """Return messages not yet drained and advance the read cursor."""
+    ensure_session(session_id)
+    log = session_messages[session_id]
+    base = session_log_base[session_id]
+    start = max(session_cursor[session_id] - base, 0)
+    session_cursor[session_id] = base + len(log)
+    return log[start:]
+
+def messages_since(session_id: str, offset: int) -> list:
+    """Return messages after `offset` without consuming them (safe to retry).
+
+    Offsets are absolute; if the log was trimmed past `offset`, returns what is left.
+    """
     ensure_session(session_id)
-    msgs = session_messages[session_id][:]
-    session_messages[session_id] = []
-    return msgs
+    return session_messages[session_id][max(offset - session_log_base[session_id], 0):]
+
+def log_end_offset(session_id: str) -> int:
+    """Absolute offset just past the newest message (the next `since`)."""
+    return session_log_base[session_id] + len(session_messages[session_id])
 # ---------------- LangGraph State ----------------
 class GraphState(TypedDict, total=False):
     spec: str
@@ -122,19 +267,55 @@ class GraphState(TypedDict, total=False):
 
 # ---------------- Multi LLM ----------------
 
-openrouter = OpenAI(
-    base_url="https://openrouter.ai/api/v1", 
-    api_key=OPENROUTER_API_KEY,
-    default_headers={
-        "HTTP-Referer": "http://localhost",
-        "X-Title": "MACC",
-    },
-)
+# Provider clients are built on first use, not at import, so the server binds sooner
+def pooled_http(connections: int) -> httpx.Client:
+    """One keep-alive pool per provider, sized to its concurrency cap.
+
+    Idle connections are kept for a minute (httpx default: 5s), so calls spaced
+    out by user think-time reuse the TLS connection instead of handshaking again.
+    """
+    return httpx.Client(limits=httpx.Limits(max_connections=connections,
+                                            max_keepalive_connections=connections,
+                                            keepalive_expiry=60))
+
+@lru_cache(maxsize=1)
+def get_mistral() -> Mistral:
+    return Mistral(api_key=MISTRAL_API_KEY, client=pooled_http(MISTRAL_SLOTS))
+
+@lru_cache(maxsize=1)
+def get_openrouter() -> OpenAI:
+    return OpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=OPENROUTER_API_KEY,
+        http_client=pooled_http(OPENROUTER_SLOTS),
+        default_headers={
+            "HTTP-Referer": "http://localhost",
+            "X-Title": "MACC",
+        },
+    )
+
+# Provider-side concurrency caps, separate from thread count, so bursts of
+# sessions queue here instead of tripping provider 429s (free tier is tighter)
+MISTRAL_SLOTS = 16
+OPENROUTER_SLOTS = 4
+mistral_slots = threading.BoundedSemaphore(MISTRAL_SLOTS)
+openrouter_slots = threading.BoundedSemaphore(OPENROUTER_SLOTS)
+
+# Replies to an identical request (models, temperature, messages) are reused for
+# an hour instead of paying for the same completion again
+RESPONSE_CACHE_SIZE = 512
+RESPONSE_CACHE_TTL = 3600
 
 class MultiLLM:
-    def __init__(self, fallback_model="qwen/qwen3-coder:free", timeout=20):
+    def __init__(self, fallback_model="qwen/qwen3-coder:free", timeout=20,
+                 primary_model="mistral-small-latest", temperature=0.2, stream_timeout=60):
+        self.primary_model = primary_model
         self.fallback_model = fallback_model
+        self.temperature = temperature
         self.timeout = timeout
+        self.stream_timeout = stream_timeout   # whole streamed reply; timeout bounds each read
+        self._responses: "OrderedDict[str, tuple[float, str, dict]]" = OrderedDict()
+        self._responses_lock = threading.Lock()   # call() runs on many threads
 
     # -------- Normalize messages --------
     def _normalize(self, prompt:str):
@@ -142,6 +323,17 @@ class MultiLLM:
             return [{"role": "user", "content": prompt}]
         return prompt
     
+    def _mistral_token_info(self, messages: list, content: str) -> dict:
+        """Estimated usage and cost for a Mistral reply (word counts, no tokenizer)."""
+        input_text = " ".join(m["content"] for m in messages)
+        token_info = {"model": self.primary_model}
+        token_info["input_tokens"] = int(len(input_text.split()) * 1.3)
+        token_info["output_tokens"] = int(len(content.split()) * 1.35)
+        #cost
+        token_info["cost"] = (token_info["input_tokens"] / 1_000_000 * 0.50) + \
+                             (token_info["output_tokens"] / 1_000_000 * 1.50)
+        return token_info
+
     # -------- Cache --------
     # @lru_cache(maxsize=128)
     def _cached_call(self, messages_json: str) -> tuple[str, dict]:
@@ -152,21 +344,14 @@ class MultiLLM:
         # ---------------- PRIMARY: Mistral ----------------
         for attempt in range(2):
             try:
-                res = mistral.chat.complete(
-                    model="mistral-small-latest",
-                    messages=messages,
-                    temperature=0.2,
-                )
+                with mistral_slots:
+                    res = get_mistral().chat.complete(
+                        model=self.primary_model,
+                        messages=messages,
+                        temperature=self.temperature,
+                    )
                 content = res.choices[0].message.content.strip()
-
-                token_info["model"] = "mistral-small-latest"
-                input_text = " ".join(m["content"] for m in messages)
-                token_info["input_tokens"] = int(len(input_text.split()) * 1.3)
-                token_info["output_tokens"] = int(len(content.split()) * 1.35)
-
-                #cost
-                token_info["cost"] = (token_info["input_tokens"] / 1_000_000 * 0.50) + \
-                                     (token_info["output_tokens"] / 1_000_000 * 1.50)
+                token_info = self._mistral_token_info(messages, content)
 
                 logging.info(f"✅ Mistral used | In≈{token_info['input_tokens']} | Out≈{token_info['output_tokens']}")
 
@@ -182,12 +367,13 @@ class MultiLLM:
         # ---------------- FALLBACK: OpenRouter ----------------
         try:
             logging.info("Falling back to OpenRouter...")
-            response = openrouter.chat.completions.create(
-                    model=self.fallback_model,
-                    messages=messages,
-                    temperature=0.2,
-                    max_tokens=4000,          # prevent overly long responses
-            )
+            with openrouter_slots:
+                response = get_openrouter().chat.completions.create(
+                        model=self.fallback_model,
+                        messages=messages,
+                        temperature=self.temperature,
+                        max_tokens=4000,          # prevent overly long responses
+                )
             content = response.choices[0].message.content.strip()
             usage = getattr(response, 'usage', None)
             if usage:
@@ -214,13 +400,48 @@ class MultiLLM:
             logging.error(f"OpenRouter fallback failed: {e}")
             return "# Error: Both LLM providers failed. Please try again.", token_info
     
+    # -------- Response cache --------
+    def _response_key(self, messages: list) -> str:
+        request = {"models": [self.primary_model, self.fallback_model],
+                   "temperature": self.temperature, "messages": messages}
+        return hashlib.sha256(orjson.dumps(request, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def _cached_response(self, key: str) -> Optional[tuple[str, dict]]:
+        with self._responses_lock:
+            hit = self._responses.get(key)
+            if hit is None:
+                return None
+            stored, content, token_info = hit
+            if time.monotonic() - stored > RESPONSE_CACHE_TTL:
+                del self._responses[key]
+                return None
+            self._responses.move_to_end(key)
+        # No provider call was made this time
+        return content, {"input_tokens": 0, "output_tokens": 0, "cost": 0.0, "model": token_info.get("model")}
+
+    def _store_response(self, key: str, content: str, token_info: dict):
+        if not content or content.startswith("# Error:"):
+            return   # never cache failures
+        with self._responses_lock:
+            self._responses[key] = (time.monotonic(), content, token_info)
+            self._responses.move_to_end(key)
+            if len(self._responses) > RESPONSE_CACHE_SIZE:
+                self._responses.popitem(last=False)
+
     # -------- REQUIRED method -------- 
-    def call(self, prompt: str) -> tuple[str, dict]:
-        """Public method - always returns (content, token_info)"""
+    def call(self, prompt: str, fresh: bool = False) -> tuple[str, dict]:
+        """Public method - always returns (content, token_info)
+
+        fresh=True skips the response cache (the new reply still replaces the cached one).
+        """
         messages = self._normalize(prompt)
+        key = self._response_key(messages)
+        cached = None if fresh else self._cached_response(key)
+        if cached is not None:
+            return cached
         messages_json = json.dumps(messages, sort_keys=True)   # make cacheable
 
-        future = executor.submit(self._cached_call, messages_json)
+        future = llm_executor.submit(self._cached_call, messages_json)
 
         # Run in thread with timeout to prevent hanging
 
@@ -232,6 +453,7 @@ class MultiLLM:
                 logging.error(f"Invalid LLM return: {result}")
                 return "# Error: Invalid LLM response", {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
 
+            self._store_response(key, *result)
             return result
         except concurrent.futures.TimeoutError:
             logging.error("LLM call timed out")
@@ -240,6 +462,51 @@ class MultiLLM:
             logging.error(f"Unexpected error in LLM call: {e}")
             return "# Error: LLM call failed unexpectedly.", {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
 
+    # -------- Streaming --------
+    def stream(self, prompt: str, on_delta, deadline: Optional[float] = None,
+               fresh: bool = False) -> tuple[str, dict]:
+        """Like call(), but passes content deltas to on_delta as Mistral produces them.
+
+        Blocking; run it in a thread. If streaming fails or comes back empty, falls
+        back to call() (the fallback provider is not streamed), so callers must treat
+        the returned content, not the deltas, as authoritative. A reply still streaming
+        after stream_timeout seconds, or past `deadline` (a time.monotonic() value) if
+        that comes first, is abandoned (no fallback) and no more deltas are sent.
+        """
+        messages = self._normalize(prompt)
+        key = self._response_key(messages)
+        cached = None if fresh else self._cached_response(key)
+        if cached is not None:
+            on_delta(cached[0])   # one delta: the client preview still updates
+            return cached
+        deadline = min(time.monotonic() + self.stream_timeout, deadline or float("inf"))
+        try:
+            parts = []
+            with mistral_slots, get_mistral().chat.stream(
+                model=self.primary_model,
+                messages=messages,
+                temperature=self.temperature,
+                timeout_ms=self.timeout * 1000,   # mistralai sends no timeout by default
+            ) as events:
+                for event in events:
+                    if time.monotonic() > deadline:
+                        logging.error("Mistral stream timed out")
+                        return "# Error: LLM call timed out. Please try again.", \
+                            {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+                    delta = event.data.choices[0].delta.content
+                    if delta:
+                        parts.append(delta)
+                        on_delta(delta)
+            content = "".join(parts).strip()
+            if content:
+                token_info = self._mistral_token_info(messages, content)
+                self._store_response(key, content, token_info)
+                return content, token_info
+            logging.warning("Empty streamed response from Mistral")
+        except Exception as e:
+            logging.error(f"Mistral stream failed: {e}")
+        return self.call(prompt, fresh=fresh)
+
 llm = MultiLLM(fallback_model="qwen/qwen3-coder:free")
 
 def merge_tokens(old, new):
@@ -253,25 +520,13 @@ def merge_tokens(old, new):
     }
 
 # ---------------- LangGraph Nodes ----------------
-#---PLANNER NODE---
-def planner_node(state: GraphState) -> dict:
-    prompt = f"""Break down this project specification into a clear numbered list of tasks.
-Project: {state['spec']}
+# Fixed instructions go in the system message and the per-request content in the
+# user message, so every call to a node shares an identical prefix that providers
+# with prompt caching can reuse.
+PLANNER_SYSTEM = """Break down the user's project specification into a clear numbered list of tasks.
 Output ONLY the numbered list. No extra text."""
-    tasks, tokens = llm.call(prompt)
-    prev = state.get("token_info", {})
-    merged = merge_tokens(prev, tokens)
-    return {"tasks": tasks, "token_info": merged}
-
-#--CODER NODE--
-def coder_node(state: GraphState) -> dict:
-    prompt = f"""Write a complete, production-ready, SINGLE-FILE Python script for the following project.
-
-Project Specification:
-{state['spec']}
 
-Tasks:
-{state.get('tasks', '')}
+CODER_SYSTEM = """Write a complete, production-ready, SINGLE-FILE Python script for the user's project.
 
 Rules:
 - All code in ONE file
@@ -280,17 +535,8 @@ Rules:
 - Include if __name__ == '__main__': block
 - Output ONLY the full Python code. No explanations, no markdown fences.
 - If the spec is too complex, write a simplified version that captures the core idea."""
-    code, tokens = llm.call(prompt)
-    prev = state.get("token_info", {})
-    merged = merge_tokens(prev, tokens)
-    return {"code": code, "token_info": merged}
 
-#--REVIEWER NODE--
-def reviewer_node(state: GraphState) -> dict:
-    prompt = f"""Review and improve the following Python code.
-
-Current code:
-{state['code']}
+REVIEWER_SYSTEM = """Review and improve the user's Python code.
 
 Improvements needed:
 - Fix any bugs
@@ -299,11 +545,84 @@ Improvements needed:
 - Keep it as a single file
 
 Output ONLY the full improved Python code. No explanations, No markdown fences."""
-    refined, tokens = llm.call(prompt)
+
+REFINE_SYSTEM = """Refine the user's code based on the suggestion given after it.
+Output ONLY the full refined Python code. No explanations, no markdown."""
+
+#---PLANNER NODE---
+def planner_node(state: GraphState, config: RunnableConfig) -> dict:
+    # Identical specs make an identical prompt, which MultiLLM's response cache serves
+    # unless the caller asked for a fresh attempt
+    tasks, tokens = llm.call([
+        {"role": "system", "content": PLANNER_SYSTEM},
+        {"role": "user", "content": f"Project: {state['spec']}"},
+    ], fresh=config.get("configurable", {}).get("fresh", False))
+    prev = state.get("token_info", {})
+    merged = merge_tokens(prev, tokens)
+    return {"tasks": tasks, "token_info": merged}
+
+#--CODER NODE--
+def coder_node(state: GraphState, config: RunnableConfig) -> dict:
+    code, tokens = llm.call([
+        {"role": "system", "content": CODER_SYSTEM},
+        {"role": "user", "content": f"Project Specification:\n{state['spec']}\n\nTasks:\n{state.get('tasks', '')}"},
+    ], fresh=config.get("configurable", {}).get("fresh", False))
+    prev = state.get("token_info", {})
+    merged = merge_tokens(prev, tokens)
+    return {"code": code, "token_info": merged}
+
+#--REVIEWER NODE--
+def reviewer_node(state: GraphState, config: RunnableConfig) -> dict:
+    # The reviewer writes the final code; stream it when the caller passed an on_delta,
+    # stopping at the caller's deadline so nothing streams after it has given up
+    configurable = config.get("configurable", {})
+    fresh = configurable.get("fresh", False)
+    on_delta = configurable.get("on_delta")
+    messages = [
+        {"role": "system", "content": REVIEWER_SYSTEM},
+        {"role": "user", "content": f"Current code:\n{state['code']}"},
+    ]
+    if on_delta:
+        refined, tokens = llm.stream(messages, on_delta, deadline=configurable.get("deadline"), fresh=fresh)
+    else:
+        refined, tokens = llm.call(messages, fresh=fresh)
     prev = state.get("token_info", {})
     merged = merge_tokens(prev, tokens)
     return {"refined_code": refined, "token_info": merged}
 
+# ---------------- Code checks ----------------
+# A whole reply wrapped in a markdown fence, which models add despite being told not to
+_FENCE_RE = re.compile(r"^\s*```[\w+-]*[ \t]*\n(.*?)\n?[ \t]*```\s*$", re.DOTALL)
+
+def strip_code_fences(code: str) -> str:
+    m = _FENCE_RE.match(code)
+    return m.group(1) if m else code
+
+def syntax_error(code: str) -> Optional[str]:
+    """None if the code parses, else a short description of the first syntax error."""
+    try:
+        ast.parse(code)
+    except SyntaxError as e:
+        return f"line {e.lineno}: {e.msg}"
+    return None
+
+async def repair_syntax(session_id: str, code: str) -> tuple[str, dict]:
+    """Strip fences; if the code does not parse, give the reviewer one try at fixing it."""
+    code = strip_code_fences(code)
+    err = syntax_error(code)
+    if err is None:
+        return code, {}
+    enqueue_message(session_id, "status", f"Generated code has a syntax error ({err}); asking the reviewer to fix it...")
+    fixed, tokens = await asyncio.to_thread(llm.call, [
+        {"role": "system", "content": REVIEWER_SYSTEM},
+        {"role": "user", "content": f"Current code:\n{code}\n\nIt does not parse ({err}). Fix that first."},
+    ])
+    fixed = strip_code_fences(fixed)
+    if syntax_error(fixed) is None:
+        return fixed, tokens
+    enqueue_message(session_id, "status", "Could not fix the syntax error automatically.")
+    return code, tokens
+
 # Build the graph once
 def build_graph():
     builder = StateGraph(GraphState)
@@ -323,42 +642,113 @@ graph = build_graph()
 # ---------------- GitHub tool ----------------
 
 class GitHubTool:
-    def push(self, repo_name: str, code: str, filename="main.py", readme=None):
-        g = Github(GITHUB_TOKEN)
-        user = g.get_user()
-        repo_short = repo_name.split("/")[-1] if "/" in repo_name else repo_name
-        
-        try:
-            repo = user.get_repo(repo_short)
-        except Exception:
-            repo = user.create_repo(repo_short, auto_init=True)
-        
-        # Update or create main file
-        try:
-            repo.create_file(filename, "Add main code", code)
-        except Exception:
+    def __init__(self):
+        # One client per process: its HTTP connection pool is reused across commits.
+        # Rate limits: GithubRetry backs off on 5xx and waits out 403/429 rate-limit
+        # replies (Retry-After / X-RateLimit-Reset); the spacing keeps a burst of
+        # commits under GitHub's secondary limits. /commit caps the total wait (COMMIT_TIMEOUT).
+        self.client = Github(
+            auth=Auth.Token(GITHUB_TOKEN),
+            per_page=100,
+            pool_size=10,
+            retry=GithubRetry(total=3, secondary_rate_wait=20),
+            seconds_between_requests=0.25,
+            seconds_between_writes=1.0,
+        )
+        self._user = None
+        self._repos: Dict[str, Any] = {}   # repo_short -> Repository, skips get_repo on re-commits
+
+    @property
+    def user(self):
+        # Resolved on first push, not at import time
+        if self._user is None:
+            self._user = self.client.get_user()
+        return self._user
+
+    def get_repo(self, repo_short: str):
+        repo = self._repos.get(repo_short)
+        if repo is None:
             try:
-                existing = repo.get_contents(filename)
-                repo.update_file(filename, "Update main code", code, existing.sha)
+                repo = self.user.get_repo(repo_short)
             except Exception:
-                pass
-        
+                repo = self.user.create_repo(repo_short, auto_init=True)
+            self._repos[repo_short] = repo
+        return repo
+
+    def push(self, repo_name: str, code: str, filename="main.py", readme=None):
+        files = {filename: code}
         if readme:
-            try:
-                repo.create_file("README.md", "Add README", readme)
-            except Exception:
-                try:
-                    existing = repo.get_contents("README.md")
-                    repo.update_file("README.md", "Update README", readme, existing.sha)
-                except Exception:
-                    pass
-        
-        return f"https://github.com/{user.login}/{repo_short}"
+            files["README.md"] = readme
+        return self.push_files(repo_name, files)
+
+    def push_files(self, repo_name: str, files: Dict[str, str], message="Update generated code"):
+        """Commit any number of files ({path: content}) as one commit; returns the repo URL."""
+        user = self.user
+        repo_short = repo_name.split("/")[-1] if "/" in repo_name else repo_name
+        repo = self.get_repo(repo_short)
+        url = f"https://github.com/{user.login}/{repo_short}"
+
+        # One commit for all files via the Git Data API, instead of a
+        # create/get_contents/update round trip and a separate commit per file
+        try:
+            ref = repo.get_git_ref(f"heads/{repo.default_branch}")
+        except GithubException as e:
+            if e.status not in (404, 409):
+                raise
+            # Empty repo (no commits yet): the Git Data API needs a parent commit,
+            # so seed it through the contents API, then commit the rest as one tree
+            (path, content), *rest = files.items()
+            repo.create_file(path, message, content)
+            if not rest:
+                return url
+            files = dict(rest)
+            ref = repo.get_git_ref(f"heads/{repo.default_branch}")
+        parent = repo.get_git_commit(ref.object.sha)
+        tree = repo.create_git_tree(
+            [InputGitTreeElement(path, "100644", "blob", content=content) for path, content in files.items()],
+            base_tree=parent.tree,
+        )
+        # Re-committing the same content yields the same tree: skip the empty commit
+        if tree.sha != parent.tree.sha:
+            commit = repo.create_git_commit(message, tree, [parent])
+            ref.edit(commit.sha, force=False)   # fast-forward only; fails rather than clobber
+
+        return url
 
 github_tool = GitHubTool()
 
 # ---------------- Background tasks ----------------
-async def generate_background(session_id: str, spec: str, github_repo: Optional[str]):
+# spec -> successful graph result, so an identical spec skips planner, coder and
+# reviewer entirely. Exact match on the stripped spec; bounded LRU with the same TTL
+# as LLM replies; `regenerate` bypasses it. Only touched from the event loop, so no lock.
+GRAPH_CACHE_SIZE = 128
+_graph_cache: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+
+def cached_graph_result(spec: str) -> Optional[dict]:
+    hit = _graph_cache.get(spec.strip())
+    if hit is None:
+        return None
+    stored, result = hit
+    if time.monotonic() - stored > RESPONSE_CACHE_TTL:
+        del _graph_cache[spec.strip()]
+        return None
+    _graph_cache.move_to_end(spec.strip())
+    # No LLM calls were made this time
+    return {**result, "token_info": {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}}
+
+def store_graph_result(spec: str, result: dict):
+    code = result.get("refined_code") or result.get("code", "")
+    if len(code.strip()) < 50 or code.startswith("# Error:"):
+        return   # never cache failures
+    _graph_cache[spec.strip()] = (time.monotonic(), result)
+    _graph_cache.move_to_end(spec.strip())
+    if len(_graph_cache) > GRAPH_CACHE_SIZE:
+        _graph_cache.popitem(last=False)
+
+GRAPH_TIMEOUT = 90   # seconds for planner + coder + reviewer
+
+async def generate_background(session_id: str, spec: str, github_repo: Optional[str],
+                              regenerate: bool = False):
     ensure_session(session_id)
     try:
         enqueue_message(session_id, "status", "Starting project generation...")
@@ -369,7 +759,11 @@ async def generate_background(session_id: str, spec: str, github_repo: Optional[
 
         # derive repo name from prompt if not provided
         if github_repo and github_repo.strip():
-            repo = github_repo.strip()
+            repo = parse_repo_name(github_repo)
+            if not repo:
+                enqueue_message(session_id, "status", f"Error: invalid GitHub repo name: {github_repo.strip()}")
+                session_done[session_id] = True
+                return
             enqueue_message(session_id, "status", f"Using provided GitHub repo: {repo}")
         else:
             slug = safe_slug(spec)
@@ -378,17 +772,45 @@ async def generate_background(session_id: str, spec: str, github_repo: Optional[
             # store repo as username/repo? We'll let GitHubTool use user's login later.
             enqueue_message(session_id, "status", f"Auto-generated repo name: {repo}")
 
-        # PLANNER (run in thread)
-        enqueue_message(session_id, "status", "Planner: breaking down tasks...")
-        enqueue_message(session_id, "status", "Coder generating code...")
-        enqueue_message(session_id, "status", "Reviewer improving code...")
+        # The reasoning summary needs only the spec: start it now, alongside the graph
+        thinking_prompt = f"Explain your reasoning step by step as Planner, Coder, and Reviewer for this project:\n{spec}. Keep it very short and just bullet points."
+        thinking_task = asyncio.create_task(asyncio.to_thread(llm.call, thinking_prompt, regenerate))
 
-        result = await asyncio.wait_for(
-            asyncio.get_event_loop().run_in_executor(
-                executor, lambda: graph.invoke({"spec": spec})
-            ),
-            timeout=90
-        )
+        result = None if regenerate else cached_graph_result(spec)
+        if result is not None:
+            enqueue_message(session_id, "status", "Same spec as an earlier project: reusing its plan and code.")
+        else:
+            # PLANNER (run in thread)
+            enqueue_message(session_id, "status", "Planner: breaking down tasks...")
+            enqueue_message(session_id, "status", "Coder generating code...")
+            enqueue_message(session_id, "status", "Reviewer improving code...")
+
+            # Reviewer output reaches the client as code_chunk previews while it is written
+            loop = asyncio.get_running_loop()
+            def enqueue_chunk(delta: str):
+                if not session_done.get(session_id, False):   # late deltas after a timeout
+                    enqueue_message(session_id, "code_chunk", delta)
+            def on_delta(delta: str):
+                loop.call_soon_threadsafe(enqueue_chunk, delta)
+            deadline = time.monotonic() + GRAPH_TIMEOUT
+            result = await asyncio.wait_for(
+                asyncio.to_thread(graph.invoke, {"spec": spec},
+                                  {"configurable": {"on_delta": on_delta, "deadline": deadline,
+                                                    "fresh": regenerate}}),
+                timeout=GRAPH_TIMEOUT
+            )
+            code, fix_tokens = await repair_syntax(session_id, result.get("refined_code") or result.get("code", ""))
+            err = syntax_error(code)
+            if err is not None:
+                # Neither cached nor kept for /commit: the session ends without a project
+                thinking_task.cancel()
+                enqueue_message(session_id, "status", f"Error: generated code does not parse ({err}). "
+                                                      "Please try again or simplify the specification.")
+                session_done[session_id] = True
+                return
+            result = {**result, "refined_code": code,
+                      "token_info": merge_tokens(result.get("token_info", {}), fix_tokens)}
+            store_graph_result(spec, result)
 
         tasks = result.get("tasks", "")
         code = result.get("refined_code") or result.get("code", "")
@@ -400,15 +822,14 @@ async def generate_background(session_id: str, spec: str, github_repo: Optional[
         if not code or len(code.strip()) < 50:
             code = "# Error: LLM returned empty output. Please try a simpler specification."
 
-        # Generate English description
-        desc, t1 = llm.call(f"Summarize what this code does in 2-3 clear sentences:\n{code}")
-        # Generate step-by-step reasoning
-        thinking = ""
-        if True:
-            thinking, t2 = llm.call(f"Explain your reasoning step by step as Planner, Coder, and Reviewer for this project:\n{spec}. Keep it very short and just bullet points.")
-        # Generate dynamic suggestions
+        # Description and suggestions are independent: run them concurrently, then collect reasoning
+        desc_prompt = f"Summarize what this code does in 2-3 clear sentences:\n{code}"
         suggestions_prompt = f"""Given this code, suggest 3 smart, specific improvements:\n{code}\nReturn only a numbered list of 3 suggestions."""
-        suggestions, t3 = llm.call(suggestions_prompt)
+        (desc, t1), (thinking, t2), (suggestions, t3) = await asyncio.gather(
+            asyncio.to_thread(llm.call, desc_prompt, regenerate),
+            thinking_task,
+            asyncio.to_thread(llm.call, suggestions_prompt, regenerate),
+        )
         enqueue_message(session_id, "token_info", token_info)
 
         # Stream new message types
@@ -417,9 +838,8 @@ async def generate_background(session_id: str, spec: str, github_repo: Optional[
         enqueue_message(session_id, "suggestions", suggestions)
 
 
-        # Stream the final code
-        for line in code.splitlines():
-            enqueue_message(session_id, "code", line)
+        # Send the final code as one message, not one per line
+        enqueue_message(session_id, "code_block", code)
 
         # Create README
         readme = f"""# {repo}
@@ -434,18 +854,17 @@ Generated by MACC (LangGraph)
 # To run:
 python main.py
 ```"""
-        project_context[session_id] = {
-            "spec": spec,
-            "github_repo": repo,
-            "tasks": tasks,
-            "code": code,
-            "readme": readme,
-            "description": desc,
-            "thinking": thinking,
-            "suggestions": suggestions,
-            "repo_url": None,
-            "token_info": token_info,
-        }
+        project_context[session_id] = SessionCtx(
+            spec=spec,
+            github_repo=repo,
+            tasks=tasks,
+            code=code,
+            readme=readme,
+            description=desc,
+            thinking=thinking,
+            suggestions=suggestions,
+            token_info=token_info,
+        )
 
         enqueue_message(session_id, "status", f"Project ready! Repo: {repo}")
         session_done[session_id] = True
@@ -456,6 +875,16 @@ python main.py
         session_done[session_id] = True
 
 
+# (code hash, normalized suggestion) -> refined code. Suggestions like "Add docstrings."
+# and "add  docstrings" recur across sessions; the exact-prompt LLM cache misses on
+# those, this one does not. Event-loop only, so no lock.
+REFINE_CACHE_SIZE = 256
+_refine_cache: "OrderedDict[tuple[str, str], str]" = OrderedDict()
+
+def refine_key(code: str, suggestion: str) -> tuple[str, str]:
+    normalized = " ".join(suggestion.casefold().split()).rstrip(".!")
+    return hashlib.sha256(code.strip().encode()).hexdigest(), normalized
+
 async def refine_background(session_id: str, suggestion: str):
     ensure_session(session_id)
     try:
@@ -464,28 +893,56 @@ async def refine_background(session_id: str, suggestion: str):
             session_done[session_id] = True
             return
         ctx = project_context[session_id]
-        current_code = ctx.get("code", "")
+        current_code = ctx.code
         enqueue_message(session_id, "status", f"Applying suggestion: {suggestion}")
-        prompt = f"""Refine the following code based on the user suggestion.
-User Suggestion: {suggestion}
-Current Code:
-{current_code}
-
-Output ONLY the full refined Python code. No explanations, no markdown."""
-        refined, token_info = llm.call(prompt)
+        # Code before the suggestion: follow-up suggestions on the same code share
+        # the longest possible prefix for provider prompt caching
+        prompt = [
+            {"role": "system", "content": REFINE_SYSTEM},
+            {"role": "user", "content": f"Current Code:\n{current_code}\n\nUser Suggestion: {suggestion}"},
+        ]
+        key = refine_key(current_code, suggestion)
+        refined = _refine_cache.get(key)
+        if refined is not None:
+            _refine_cache.move_to_end(key)
+            token_info = {"input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+        else:
+            # Stream the refinement as it is written; the final code_block replaces these chunks
+            loop = asyncio.get_running_loop()
+            def on_delta(delta: str):
+                loop.call_soon_threadsafe(enqueue_message, session_id, "code_chunk", delta)
+            refined, token_info = await asyncio.wait_for(
+                asyncio.to_thread(llm.stream, prompt, on_delta),
+                timeout=90
+            )
+            if len(refined.strip()) >= 50 and not refined.startswith("# Error:"):
+                # Same bar as generation: code that does not parse is never cached or committed
+                refined, fix_tokens = await repair_syntax(session_id, refined)
+                token_info = merge_tokens(token_info, fix_tokens)
+                if syntax_error(refined) is None:
+                    _refine_cache[key] = refined
+                    if len(_refine_cache) > REFINE_CACHE_SIZE:
+                        _refine_cache.popitem(last=False)
+                else:
+                    refined = ""
         
-        if not refined or len(refined.strip()) < 50:
-            refined = current_code
-            enqueue_message(session_id, "status", "LLM returned empty refinement, keeping original code.")
+        if not refined or len(refined.strip()) < 50 or refined.startswith("# Error:"):
+            enqueue_message(session_id, "status", "No usable refinement, keeping original code.")
+        elif refined.strip() == current_code.strip():
+            # Nothing changed: the client keeps the code it has, no need to re-send it
+            enqueue_message(session_id, "token_info", token_info)
+            enqueue_message(session_id, "status", "No changes needed for this suggestion.")
         else:
-            ctx["code"]=refined #update
-            ctx["token_info"] = token_info
+            ctx.code = refined #update
+            ctx.token_info = token_info
             enqueue_message(session_id, "token_info", token_info)
-
-        # stream refined code
-        for ln in refined.splitlines():
-            enqueue_message(session_id, "code", ln)
-        enqueue_message(session_id, "status", "Refinement applied.")
+            # send refined code in one message
+            enqueue_message(session_id, "code_block", refined)
+            enqueue_message(session_id, "status", "Refinement applied.")
+        session_done[session_id] = True
+    except asyncio.TimeoutError:
+        logging.error("refine_background timed out")
+        enqueue_message(session_id, "status", "Error: refinement timed out, keeping original code.")
         session_done[session_id] = True
     except Exception as e:
         logging.exception("refine_background error")
@@ -493,38 +950,211 @@ Output ONLY the full refined Python code. No explanations, no markdown."""
         session_done[session_id] = True
 
         
+# ---------------- Job queue ----------------
+# Generation/refinement jobs run on a fixed set of worker coroutines instead of one
+# task per request, so a burst queues up (and is refused past the cap) rather than
+# piling unbounded LLM work onto the loop and thread pools.
+JOB_WORKERS = 8
+JOB_QUEUE_SIZE = 128
+
+# Thread pools for blocking work. Graph runs go through asyncio.to_thread on the
+# loop's default executor (resized at startup); LLM calls get their own pool:
+# graph nodes block on llm.call futures, so sharing one pool lets a few
+# concurrent sessions occupy every worker and starve their own LLM calls.
+# Sized from the concurrency above, not the core count: llm.call's timeout starts
+# at submit, so a call queued behind busy workers times out without being sent.
+# A job runs up to 3 llm.calls at once (thinking alongside the graph, then
+# description and suggestions); each also holds a to_thread worker while it waits.
+LLM_POOL_SIZE = max(JOB_WORKERS * 3, MISTRAL_SLOTS + OPENROUTER_SLOTS)
+POOL_SIZE = JOB_WORKERS * 4 + 4   # + commits and pre-warm
+llm_executor = ThreadPoolExecutor(max_workers=LLM_POOL_SIZE, thread_name_prefix="llm")
+job_queue: asyncio.Queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)   # replaced at startup
+
+async def job_worker():
+    while True:
+        job, args = await job_queue.get()
+        try:
+            await job(*args)
+        except Exception:
+            logging.exception("job failed")
+        finally:
+            job_queue.task_done()
+
+def submit_job(job, *args):
+    """Queue a background coroutine function; 503 when the backlog is full."""
+    try:
+        job_queue.put_nowait((job, args))
+    except asyncio.QueueFull:
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly")
+
+# Identical spec+repo submissions from the same client that are still running share
+# one session (double-clicks, refreshes, client retries) instead of paying for a
+# second run. Never across clients: a session_id is all it takes to read and commit it.
+_inflight: Dict[str, str] = {}   # sha256(client, spec, repo) -> session_id
+
+def inflight_key(client_id: str, spec: str, github_repo: Optional[str]) -> str:
+    return hashlib.sha256(f"{client_id}\0{spec}\0{(github_repo or '').strip()}".encode()).hexdigest()
+
+async def generate_job(key: Optional[str], session_id: str, spec: str, github_repo: Optional[str],
+                       regenerate: bool = False):
+    try:
+        await generate_background(session_id, spec, github_repo, regenerate)
+    finally:
+        if key and _inflight.get(key) == session_id:
+            del _inflight[key]
+
 # ---------------- API endpoints ----------------
 
 @app.post("/generate-project")
 async def generate_project(req: ProjectRequest):
     """Start generation in background and immediately return session_id."""
+    # Same client re-sending a running spec+repo gets that session back (`deduped`);
+    # it reads with since=0 to see every message. No client_id, no dedupe.
+    key = inflight_key(req.client_id, req.spec, req.github_repo) if req.client_id else None
+    running = _inflight.get(key) if key else None
+    if running and running in session_seen and not session_done.get(running, False):
+        return {"session_id": running, "deduped": True}
     session_id = str(uuid.uuid4())
+    # queue background job (before creating the session, so a 503 leaves nothing behind)
+    submit_job(generate_job, key, session_id, req.spec, req.github_repo, req.regenerate)
+    if key:
+        _inflight[key] = session_id
     # initialize
     ensure_session(session_id)
     session_done[session_id] = False
-    # start background
-    asyncio.create_task(generate_background(session_id, req.spec, req.github_repo))
     return {"session_id": session_id}
 
+MAX_BATCH_SPECS = 8
+
+@app.post("/generate-projects")
+async def generate_projects(reqs: List[ProjectRequest]):
+    """Start several generations in one request; returns one /generate-project reply per spec, in order.
+
+    All or nothing: if the queue cannot take the whole batch, nothing is started (503).
+    """
+    if not 1 <= len(reqs) <= MAX_BATCH_SPECS:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {MAX_BATCH_SPECS} specs")
+    if job_queue.maxsize - job_queue.qsize() < len(reqs):
+        raise HTTPException(status_code=503, detail="Server busy, please retry shortly")
+    return {"sessions": [await generate_project(req) for req in reqs]}
+
 @app.get("/updates/{session_id}")
-async def get_updates(session_id: str):
-    """Return queued messages (and done flag) for session; clears returned messages."""
+async def get_updates(session_id: str, request: Request, since: Optional[int] = Query(None, ge=0),
+                      wait: float = Query(0, ge=0, le=30)):
+    """Return new messages (and done flag) for session."""
     ensure_session(session_id)
-    msgs = drain_messages(session_id)
-    done = session_done.get(session_id, False)
+    # `wait` long-polls: hold the request until there is something to return
+    deadline = time.monotonic() + wait
+    while True:
+        wakeup = next_message_event(session_id)
+        # No `since`: drain the shared cursor. With it: messages after that offset,
+        # safe to retry; the client passes back `next_offset` on its next poll
+        msgs = drain_messages(session_id) if since is None else messages_since(session_id, since)
+        done = session_done.get(session_id, False)
+        remaining = deadline - time.monotonic()
+        if msgs or done or remaining <= 0:
+            break
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=remaining)
+        except asyncio.TimeoutError:
+            pass
     # include repo_url if available
-    repo_url = project_context.get(session_id, {}).get("repo_url")
-    return {"messages": msgs, "done": done, "repo_url": repo_url}
+    ctx = project_context.get(session_id)
+    repo_url = ctx.repo_url if ctx else None
+    next_offset = log_end_offset(session_id)
+    payload = {"messages": msgs, "done": done, "repo_url": repo_url, "next_offset": next_offset}
+    if since is None:
+        return payload   # draining changes state, so these replies are never cacheable
+    # An offset poll's reply is fully determined by these fields
+    etag = f'W/"{since}-{next_offset}-{int(done)}-{int(bool(repo_url))}"'   # If-None-Match -> 304
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return ORJSONResponse(payload, headers=headers)
+
+# After a wakeup, wait this long for more messages so a burst of streamed deltas
+# goes out as one chunk (one ASGI send) instead of one chunk per delta
+STREAM_COALESCE_SECS = 0.05
+
+async def stream_messages(session_id: str, since: Optional[int] = None):
+    """Yield session messages as newline-delimited JSON bytes until the session is done."""
+    # Each chunk holds every message available at that moment, one JSON object per line
+    while True:
+        if session_id not in session_seen:
+            break   # evicted by prune_sessions; draining would silently recreate it
+        wakeup = next_message_event(session_id)
+        if since is None:
+            msgs = drain_messages(session_id)
+        else:   # own cursor, so several streams of one session each get every message
+            msgs = messages_since(session_id, since)
+            since = log_end_offset(session_id)
+        if msgs:
+            yield b"".join(orjson.dumps(msg) + b"\n" for msg in msgs)
+            continue
+        if session_done.get(session_id, False):
+            break
+        # Woken by the next enqueue, no polling; the timeout is only a safety net
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout=15)
+        except asyncio.TimeoutError:
+            # keep idle proxies from closing the connection during long LLM calls
+            yield b"\n"
+            continue
+        await asyncio.sleep(STREAM_COALESCE_SECS)
+    ctx = project_context.get(session_id)
+    repo_url = ctx.repo_url if ctx else None
+    yield orjson.dumps({"type": "done", "message": "", "repo_url": repo_url}) + b"\n"
+
+async def sse_frames(lines):
+    """Re-frame the NDJSON stream as Server-Sent Events for EventSource clients."""
+    async for chunk in lines:
+        if chunk == b"\n":
+            yield b": keep-alive\n\n"   # SSE comment line
+        else:
+            yield b"".join(b"data: " + line + b"\n\n" for line in chunk.splitlines())
+
+async def gzip_stream(chunks):
+    """Gzip a byte stream, sync-flushing each chunk so frames are never held back."""
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    async for chunk in chunks:
+        yield z.compress(chunk) + z.flush(zlib.Z_SYNC_FLUSH)
+    yield z.flush()
+
+@app.get("/updates-stream/{session_id}")
+async def stream_updates(session_id: str, request: Request, since: Optional[int] = Query(None, ge=0)):
+    """Push session messages over one long-lived connection instead of polling."""
+    ensure_session(session_id)
+    body = stream_messages(session_id, since)   # `since`: read from an offset, not the shared cursor
+    # NDJSON by default; Server-Sent Events for Accept: text/event-stream
+    media_type = "application/x-ndjson"
+    if "text/event-stream" in request.headers.get("accept", ""):
+        body = sse_frames(body)
+        media_type = "text/event-stream"
+    # Never cache the stream, and tell nginx-style proxies not to buffer it either
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    # GZipMiddleware buffers streamed bodies, so compress here and let it pass through
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip_stream(body)
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(body, media_type=media_type, headers=headers)
 
 @app.post("/suggest-changes")
 async def suggest_changes(req: SuggestionRequest):
     """Start refinement (background) and return session_id (same)."""
-    if req.session_id not in session_messages and req.session_id not in project_context:
+    if req.session_id not in project_context:
+        if req.session_id in session_messages:
+            # Still generating (or it failed): there is no code to refine yet
+            raise HTTPException(status_code=409, detail="Session has no finished project to refine yet")
         raise HTTPException(status_code=404, detail="Session not found")
+    since = log_end_offset(req.session_id)   # stream from here for just the refinement's messages
+    submit_job(refine_background, req.session_id, req.suggestion)
     ensure_session(req.session_id)
     session_done[req.session_id] = False
-    asyncio.create_task(refine_background(req.session_id, req.suggestion))
-    return {"session_id": req.session_id}
+    return {"session_id": req.session_id, "since": since}
+
+# Longest /commit waits on GitHub (retries and rate-limit backoff included) before
+# answering; keep it below the frontend's commit read timeout
+COMMIT_TIMEOUT = 120
 
 @app.post("/commit")
 async def commit(req: CommitRequest):
@@ -532,16 +1162,24 @@ async def commit(req: CommitRequest):
     if sid not in project_context:
         raise HTTPException(status_code=404, detail="Session not found")
     ctx = project_context[sid]
-    repo_name = ctx.get("github_repo")
-    code = ctx.get("code", "")
-    readme = ctx.get("readme", "")
+    repo_name = ctx.github_repo
+    code = ctx.code
+    readme = ctx.readme
     if not repo_name:
         raise HTTPException(status_code=400, detail="No repo name in session")
     try:
-        url = github_tool.push(repo_name, code, filename="main.py", readme=readme)
-        ctx["repo_url"] = url
+        # PyGithub is blocking; keep its several HTTPS calls off the event loop
+        url = await asyncio.wait_for(
+            asyncio.to_thread(github_tool.push, repo_name, code, filename="main.py", readme=readme),
+            timeout=COMMIT_TIMEOUT
+        )
+        ctx.repo_url = url
         enqueue_message(sid, "status", f"Code committed to GitHub: {url}")
         return {"status": "committed", "repo_url": url}
+    except asyncio.TimeoutError:
+        logging.error("commit timed out")
+        raise HTTPException(status_code=504, detail="GitHub is rate limiting or slow; the commit may still "
+                                                    "land, so check the repo before retrying")
     except Exception as e:
         logging.exception("commit failed")
         raise HTTPException(status_code=500, detail=f"GitHub commit failed: {e}")
@@ -554,4 +1192,6 @@ async def root():
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8000))
-    uvicorn.run("main:app", host="0.0.0.0", port=port)
\ No newline at end of file
+    # Pass the app object: an import string would load this file a second time
+    # (as "main", next to "__main__"), building every client and route twice
+    uvicorn.run(app, host="0.0.0.0", port=port)
\ No newline at end of file
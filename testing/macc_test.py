@@ -3,15 +3,31 @@ import os
 import sys
 import pytest
 import asyncio
+import contextlib
 import time
 from dotenv import load_dotenv
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import macc.main as macc_main
 from macc.main import llm, graph, safe_slug, GitHubTool
 
 load_dotenv()
 
+
+@pytest.fixture(autouse=True)
+def fresh_state():
+    """Every test starts and ends with empty session stores and caches"""
+    stores = (macc_main.session_messages, macc_main.session_cursor, macc_main.session_log_base,
+              macc_main.project_context, macc_main.session_done, macc_main.session_wakeup,
+              macc_main.session_seen, macc_main._inflight, macc_main._graph_cache,
+              macc_main._refine_cache, macc_main.llm._responses)
+    for store in stores:
+        store.clear()
+    yield
+    for store in stores:
+        store.clear()
+
 # ============================
 # Basic LLM Tests
 # ============================
@@ -70,9 +86,334 @@ def test_safe_slug():
     """Test the slug generation utility"""
     assert safe_slug("Build a Weather App") == "build-a-weather-app"
     assert safe_slug("Hello World Project!!!") == "hello-world-project"
+    assert safe_slug("snake_case CLI (v2.0)") == "snake-case-cli-v2-0"
+    assert safe_slug("Café — menu app") == "café-menu-app"
     assert len(safe_slug("A very long project name that should be truncated because its way too long")) <= 28
 
 
+def test_parse_repo_name():
+    """Repo names, owner/name and GitHub URLs all resolve to the short name"""
+    assert macc_main.parse_repo_name("weather-app") == "weather-app"
+    assert macc_main.parse_repo_name("octocat/hello.world") == "hello.world"
+    assert macc_main.parse_repo_name("https://github.com/octocat/demo_repo.git") == "demo_repo"
+    assert macc_main.parse_repo_name("not a repo") is None
+    assert macc_main.parse_repo_name("a/b/c") is None
+    assert macc_main.parse_repo_name("github.com/owner/repo") == "repo"
+    assert macc_main.parse_repo_name("x" * 100) == "x" * 100
+    for bad in (".", "..", "-", "x" * 101, "https://github.com/octocat", "github.com/octocat"):
+        assert macc_main.parse_repo_name(bad) is None, bad
+
+
+def test_code_checks():
+    """Fenced replies are unwrapped and syntax errors are reported"""
+    assert macc_main.strip_code_fences("```python\nprint(1)\n```") == "print(1)"
+    assert macc_main.strip_code_fences("print(1)") == "print(1)"
+    assert macc_main.syntax_error("def ok():\n    return 1\n") is None
+    assert macc_main.syntax_error("def broken(:\n").startswith("line 1")
+
+
+def test_sessions_are_bounded(monkeypatch):
+    """Oldest sessions are evicted once MAX_SESSIONS is exceeded"""
+    monkeypatch.setattr(macc_main, "MAX_SESSIONS", 2)
+    for sid in ("s1", "s2", "s3"):
+        macc_main.enqueue_message(sid, "status", "hi")
+
+    assert "s1" not in macc_main.session_messages
+    assert "s1" not in macc_main.session_done
+    assert macc_main.drain_messages("s3") == [{"type": "status", "message": "hi"}]
+
+
+def test_message_log_is_bounded(monkeypatch):
+    """Trimming the log keeps offsets absolute"""
+    monkeypatch.setattr(macc_main, "MAX_LOG_MESSAGES", 8)
+    for i in range(9):
+        macc_main.enqueue_message("log", "code_chunk", str(i))
+
+    assert len(macc_main.session_messages["log"]) == 7
+    assert macc_main.log_end_offset("log") == 9
+    assert [m["message"] for m in macc_main.messages_since("log", 7)] == ["7", "8"]
+    assert len(macc_main.drain_messages("log")) == 7
+    macc_main.enqueue_message("log", "status", "next")
+    assert macc_main.drain_messages("log") == [{"type": "status", "message": "next"}]
+
+
+@pytest.mark.asyncio
+async def test_stream_ends_when_session_evicted():
+    """An open update stream stops instead of recreating an evicted session"""
+    macc_main.ensure_session("gone")
+    del macc_main.session_seen["gone"]
+
+    frames = [f async for f in macc_main.stream_messages("gone")]
+
+    assert len(frames) == 1 and b'"done"' in frames[0]
+    assert "gone" not in macc_main.session_seen
+
+
+@pytest.mark.asyncio
+async def test_stream_batches_pending_messages():
+    """Messages already queued go out together in one chunk"""
+    sid = "batched"
+    for i in range(3):
+        macc_main.enqueue_message(sid, "code_chunk", str(i))
+    macc_main.session_done[sid] = True
+
+    frames = [f async for f in macc_main.stream_messages(sid)]
+    assert len(frames) == 2 and frames[0].count(b"\n") == 3
+
+    async def replay():
+        for f in frames:
+            yield f
+    sse = [f async for f in macc_main.sse_frames(replay())]
+    assert sse[0].count(b"data: ") == 3 and sse[0].endswith(b"\n\n")
+
+
+def test_planner_reuses_plan_for_same_spec(monkeypatch):
+    """Identical specs are served from the response cache; errors are not cached"""
+    calls = []
+    def fake_call(messages_json):
+        calls.append(messages_json)
+        return ("# Error: LLM call timed out." if len(calls) == 1 else "1. Do it"), {}
+    monkeypatch.setattr(macc_main.llm, "_cached_call", fake_call)
+    state = {"spec": "plan cache test spec"}
+
+    assert macc_main.planner_node(state, {})["tasks"].startswith("# Error:")
+    assert macc_main.planner_node(state, {})["tasks"] == "1. Do it"
+    assert macc_main.planner_node(state, {})["tasks"] == "1. Do it"
+    assert len(calls) == 2
+
+
+def test_stream_passes_deltas(monkeypatch):
+    """MultiLLM.stream forwards each delta and returns the joined content"""
+    from types import SimpleNamespace as NS
+    pieces = ["def add(a, b):\n", "    return a + b\n"]
+    events = [NS(data=NS(choices=[NS(delta=NS(content=p))])) for p in pieces]
+    fake = NS(chat=NS(stream=lambda **kwargs: contextlib.nullcontext(iter(events))))
+    monkeypatch.setattr(macc_main, "get_mistral", lambda: fake)
+    seen = []
+
+    content, token_info = macc_main.llm.stream("refine this", seen.append)
+
+    assert seen == pieces
+    assert content == "".join(pieces).strip()
+    assert token_info["model"] == "mistral-small-latest"
+
+
+def test_repeated_request_is_served_from_cache(monkeypatch):
+    """Identical requests reach the provider once; another temperature is a different request"""
+    model = macc_main.MultiLLM()
+    sent = []
+    def fake_call(messages_json):
+        sent.append(messages_json)
+        return "print('cached')", {"input_tokens": 5, "output_tokens": 3, "cost": 0.01, "model": "m"}
+    monkeypatch.setattr(model, "_cached_call", fake_call)
+
+    first = model.call("same prompt")
+    second = model.call("same prompt")
+    assert first[0] == second[0] and len(sent) == 1
+    assert second[1]["cost"] == 0.0
+
+    model.temperature = 0.9
+    model.call("same prompt")
+    assert len(sent) == 2
+
+
+def test_stream_gives_up_after_deadline(monkeypatch):
+    """A stream still running past stream_timeout stops sending deltas and reports a timeout"""
+    from types import SimpleNamespace as NS
+    sent = {}
+    def slow_events(**kwargs):
+        sent.update(kwargs)
+        def gen():
+            yield NS(data=NS(choices=[NS(delta=NS(content="x = 1\n"))]))
+            time.sleep(0.05)
+            yield NS(data=NS(choices=[NS(delta=NS(content="y = 2\n"))]))
+        return contextlib.nullcontext(gen())
+    monkeypatch.setattr(macc_main, "get_mistral", lambda: NS(chat=NS(stream=slow_events)))
+    model = macc_main.MultiLLM(timeout=5, stream_timeout=0.01)
+    seen = []
+
+    content, _ = model.stream("slow one", seen.append)
+
+    assert content.startswith("# Error:") and seen == ["x = 1\n"]
+    assert sent["timeout_ms"] == 5000
+
+
+def test_reviewer_streams_when_asked(monkeypatch):
+    """The reviewer node streams through on_delta when one is configured"""
+    deadlines = []
+    def fake_stream(messages, on_delta, deadline=None, fresh=False):
+        deadlines.append(deadline)
+        on_delta("x = ")
+        on_delta("1\n")
+        return "x = 1", {"cost": 0.0}
+    monkeypatch.setattr(macc_main.llm, "stream", fake_stream)
+    deltas = []
+    config = {"configurable": {"on_delta": deltas.append, "deadline": 123.0}}
+    out = macc_main.reviewer_node({"code": "x=1"}, config)
+    assert out["refined_code"] == "x = 1"
+    assert deltas == ["x = ", "1\n"]
+    assert deadlines == [123.0]
+
+
+def test_spec_result_cache():
+    """Identical specs reuse a good result at zero cost; failures are not stored"""
+    good = {"tasks": "1. x", "refined_code": "print('hello')\n" * 5, "token_info": {"cost": 0.01}}
+    macc_main.store_graph_result("cache me ", good)
+    macc_main.store_graph_result("failing spec", {"refined_code": "# Error: LLM call timed out."})
+
+    hit = macc_main.cached_graph_result("cache me")
+    assert hit["refined_code"] == good["refined_code"]
+    assert hit["token_info"]["cost"] == 0.0
+    assert macc_main.cached_graph_result("failing spec") is None
+
+
+def test_unparsable_generation_is_not_kept(monkeypatch):
+    """Code still broken after the repair attempt is neither cached nor left for /commit"""
+    broken = "def add(a, b:\n    return a + b\n" * 3
+    monkeypatch.setattr(macc_main.graph, "invoke", lambda state, config: {"tasks": "1. add", "refined_code": broken})
+    monkeypatch.setattr(macc_main.llm, "call", lambda prompt, fresh=False: (broken, {"cost": 0.01}))
+    sid = "broken-gen"
+    macc_main.ensure_session(sid)
+
+    asyncio.run(macc_main.generate_background(sid, "add numbers", None))
+
+    assert sid not in macc_main.project_context
+    assert not macc_main._graph_cache
+    assert macc_main.session_done[sid]
+    statuses = [m["message"] for m in macc_main.messages_since(sid, 0) if m["type"] == "status"]
+    assert statuses[-1].startswith("Error: generated code does not parse")
+
+
+def test_spec_result_cache_expires_and_can_be_bypassed(monkeypatch):
+    """Cached results expire with the TTL; regenerate ignores the cached result and replies"""
+    code = "print('hello')\n" * 5
+    macc_main.store_graph_result("again", {"tasks": "1. x", "refined_code": code, "token_info": {}})
+    monkeypatch.setattr(macc_main, "RESPONSE_CACHE_TTL", -1)
+    assert macc_main.cached_graph_result("again") is None
+
+    sent = []
+    def fake_call(messages_json):
+        sent.append(messages_json)
+        return code, {"cost": 0.01}
+    monkeypatch.setattr(macc_main.llm, "_cached_call", fake_call)
+    monkeypatch.setattr(macc_main, "RESPONSE_CACHE_TTL", 3600)
+    macc_main.llm.call("same question")
+    macc_main.llm.call("same question")
+    macc_main.llm.call("same question", fresh=True)
+    assert len(sent) == 2
+
+
+def test_duplicate_generate_requests_share_session(monkeypatch):
+    """A second identical submission from the same client attaches to the running session"""
+    queued = []
+    monkeypatch.setattr(macc_main, "submit_job", lambda job, *args: queued.append(args))
+    req = macc_main.ProjectRequest(spec="dedupe me", github_repo="me/repo", client_id="browser-1")
+
+    first = asyncio.run(macc_main.generate_project(req))
+    second = asyncio.run(macc_main.generate_project(req))
+    assert second == {"session_id": first["session_id"], "deduped": True}
+    assert len(queued) == 1
+
+    macc_main.session_done[first["session_id"]] = True
+    third = asyncio.run(macc_main.generate_project(req))
+    assert third["session_id"] != first["session_id"]
+
+
+def test_generate_requests_from_other_clients_get_own_session(monkeypatch):
+    """Identical specs are never shared across clients, or without a client_id"""
+    queued = []
+    monkeypatch.setattr(macc_main, "submit_job", lambda job, *args: queued.append(args))
+    reqs = [macc_main.ProjectRequest(spec="same spec", client_id=c) for c in ("browser-1", "browser-2", None, None)]
+
+    out = [asyncio.run(macc_main.generate_project(req)) for req in reqs]
+    assert len({o["session_id"] for o in out}) == 4 and len(queued) == 4
+    assert not any(o.get("deduped") for o in out)
+
+
+def test_streams_with_offsets_each_get_every_message():
+    """Two readers of one session with since=0 both see the code, not half each"""
+    sid = "two-readers"
+    macc_main.ensure_session(sid)
+    macc_main.enqueue_message(sid, "code_block", "print('hi')")
+    macc_main.session_done[sid] = True
+
+    async def read():
+        return b"".join([chunk async for chunk in macc_main.stream_messages(sid, since=0)])
+
+    for body in (asyncio.run(read()), asyncio.run(read())):
+        assert b"code_block" in body and b'"type":"done"' in body
+
+
+def test_refine_reuses_near_duplicate_suggestion(monkeypatch):
+    """Suggestions differing only in case, spacing or final period share one refinement"""
+    code = "def add(a, b):\n    return a + b\n" * 3
+    refined = 'def add(a, b):\n    """Add two numbers."""\n    return a + b\n' * 3
+    calls = []
+    monkeypatch.setattr(macc_main.llm, "stream", lambda prompt, on_delta: calls.append(prompt) or (refined, {"cost": 0.01}))
+    for sid, suggestion in (("refine-a", "Add docstrings."), ("refine-b", "add   docstrings")):
+        macc_main.project_context[sid] = macc_main.SessionCtx(spec="add", github_repo="r", tasks="", code=code)
+        asyncio.run(macc_main.refine_background(sid, suggestion))
+        assert macc_main.project_context[sid].code == refined
+    assert len(calls) == 1
+
+
+def test_refinement_that_does_not_parse_is_discarded(monkeypatch):
+    """A broken refinement is neither cached nor applied, even after the repair attempt"""
+    code = "def add(a, b):\n    return a + b\n" * 3
+    broken = "def add(a, b:\n    return a + b\n" * 3
+    monkeypatch.setattr(macc_main.llm, "stream", lambda prompt, on_delta: (broken, {"cost": 0.01}))
+    monkeypatch.setattr(macc_main.llm, "call", lambda prompt: (broken, {"cost": 0.01}))
+    macc_main.project_context["refine-broken"] = macc_main.SessionCtx(spec="add", github_repo="r", tasks="", code=code)
+
+    asyncio.run(macc_main.refine_background("refine-broken", "add types"))
+
+    assert macc_main.project_context["refine-broken"].code == code
+    assert not macc_main._refine_cache
+
+
+def test_batch_generate_starts_each_spec(monkeypatch):
+    """A batch returns one session per spec; identical specs share one"""
+    queued = []
+    monkeypatch.setattr(macc_main, "submit_job", lambda job, *args: queued.append(args))
+    reqs = [macc_main.ProjectRequest(spec=s, github_repo="", client_id="browser-1")
+            for s in ("batch a", "batch b", "batch a")]
+
+    out = asyncio.run(macc_main.generate_projects(reqs))["sessions"]
+    assert len(out) == 3 and len(queued) == 2
+    assert out[2] == {"session_id": out[0]["session_id"], "deduped": True}
+
+    with pytest.raises(macc_main.HTTPException):
+        asyncio.run(macc_main.generate_projects([]))
+
+
+def test_offset_poll_not_modified():
+    """Repeating an offset poll's ETag gets a 304 until new messages arrive"""
+    from fastapi.testclient import TestClient
+    client = TestClient(macc_main.app)
+    sid = "etag-session"
+    macc_main.enqueue_message(sid, "status", "one")
+
+    first = client.get(f"/updates/{sid}?since=0")
+    etag = first.headers["etag"]
+    assert first.json()["next_offset"] == 1
+    assert client.get(f"/updates/{sid}?since=0", headers={"If-None-Match": etag}).status_code == 304
+
+    macc_main.enqueue_message(sid, "status", "two")
+    again = client.get(f"/updates/{sid}?since=0", headers={"If-None-Match": etag})
+    assert again.status_code == 200 and len(again.json()["messages"]) == 2
+
+
+def test_suggestion_needs_a_finished_project():
+    """Suggestions for a session still generating are refused, not run against no code"""
+    from fastapi.testclient import TestClient
+    client = TestClient(macc_main.app)
+    macc_main.enqueue_message("generating", "status", "Planner: breaking down tasks...")
+
+    assert client.post("/suggest-changes", json={"session_id": "generating", "suggestion": "x"}).status_code == 409
+    assert client.post("/suggest-changes", json={"session_id": "unknown", "suggestion": "x"}).status_code == 404
+    assert macc_main.session_done["generating"] is False
+
+
 # ============================
 # Tool Tests
 # ============================
@@ -83,6 +424,56 @@ def test_github_tool_initialization():
     assert tool is not None
 
 
+def test_push_files_makes_one_commit(monkeypatch):
+    """All files land in a single tree and commit"""
+    from types import SimpleNamespace as NS
+    calls = []
+    repo = NS(
+        default_branch="main",
+        get_git_ref=lambda name: NS(object=NS(sha="p"), edit=lambda sha, force: calls.append(("edit", sha))),
+        get_git_commit=lambda sha: NS(tree=NS(sha="old")),
+        create_git_tree=lambda elems, base_tree: calls.append(("tree", len(elems))) or NS(sha="new"),
+        create_git_commit=lambda msg, tree, parents: calls.append(("commit", msg)) or NS(sha="c"),
+    )
+    tool = GitHubTool()
+    tool._user = NS(login="me")
+    monkeypatch.setattr(tool, "get_repo", lambda name: repo)
+
+    url = tool.push_files("me/proj", {"main.py": "x", "requirements.txt": "y", "tests/t.py": "z"}, "Add files")
+    assert url == "https://github.com/me/proj"
+    assert calls == [("tree", 3), ("commit", "Add files"), ("edit", "c")]
+
+
+def test_push_files_seeds_empty_repo(monkeypatch):
+    """A repo with no commits gets its first file via the contents API, the rest as one commit"""
+    from types import SimpleNamespace as NS
+    from github import GithubException
+    calls = []
+    def get_git_ref(name):
+        if not any(c[0] == "create_file" for c in calls):
+            raise GithubException(409, {"message": "Git Repository is empty."}, None)
+        return NS(object=NS(sha="p"), edit=lambda sha, force: calls.append(("edit", sha)))
+    repo = NS(
+        default_branch="main",
+        get_git_ref=get_git_ref,
+        create_file=lambda path, msg, content: calls.append(("create_file", path)),
+        get_git_commit=lambda sha: NS(tree=NS(sha="old")),
+        create_git_tree=lambda elems, base_tree: calls.append(("tree", len(elems))) or NS(sha="new"),
+        create_git_commit=lambda msg, tree, parents: calls.append(("commit", msg)) or NS(sha="c"),
+    )
+    tool = GitHubTool()
+    tool._user = NS(login="me")
+    monkeypatch.setattr(tool, "get_repo", lambda name: repo)
+
+    url = tool.push_files("me/proj", {"main.py": "x", "README.md": "y"}, "First push")
+    assert url == "https://github.com/me/proj"
+    assert calls == [("create_file", "main.py"), ("tree", 1), ("commit", "First push"), ("edit", "c")]
+
+    calls.clear()
+    tool.push_files("me/proj", {"main.py": "x"}, "Only file")
+    assert calls == [("create_file", "main.py")]
+
+
 # ============================
 # Performance / Timeout Test
 # ============================
@@ -2,7 +2,7 @@
 import os
 import pytest
 from dotenv import load_dotenv
-from main import github_tool, safe_slug, GitHubTool
+from macc.main import github_tool, safe_slug, GitHubTool
 
 load_dotenv()
 